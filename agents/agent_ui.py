@@ -1,15 +1,52 @@
 import gradio as gr
 import httpx
-import json
+import orjson
 import asyncio
 
+# --- Backend HTTP client ---
+
+_CLIENT: httpx.AsyncClient | None = None
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared AsyncClient, creating it on first use so keep-alive
+    connections to the backend are reused across queries.
+    """
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(
+            timeout=httpx.Timeout(180.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        )
+    return _CLIENT
+
+# Not called in this package: the FastAPI app that mounts agent_gradio_ui must
+# register it, e.g. app.add_event_handler("shutdown", close_client). atexit
+# can't be used because aclose() has to run on the serving event loop.
+async def close_client():
+    """Closes the shared AsyncClient; call from the app's shutdown hook."""
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
 # --- Gradio Interface ---
 
+# Event types rendered as a labelled line in the thoughts panel
+_THOUGHT_LABELS = {
+    "thought": "💭 Thought",
+    "action": "⚡ Action",
+    "action_input": "📥 Action Input",
+}
+
+# Upper bound on queued events folded into a single UI update
+_MAX_EVENT_BATCH = 16
+
 async def _stream_from_backend(query: str, queue: asyncio.Queue):
     """
     Handles the httpx streaming from the backend and puts events into a queue.
     """
-    client = httpx.AsyncClient(timeout=180.0)
+    client = get_client()
     try:
         async with client.stream("POST", "http://localhost:8000/api/agent/invoke",
                                  json={"query": query}, headers={"Accept": "text/event-stream"}) as response:
@@ -19,30 +56,16 @@ async def _stream_from_backend(query: str, queue: asyncio.Queue):
                 await queue.put({"type": "stream_end"})
                 return
 
-            buffer = ""
-            async for chunk in response.aiter_bytes():
+            # httpx handles chunk boundaries; SSE frames are "data: {...}" lines
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
                 try:
-                    decoded_chunk = chunk.decode("utf-8")
-                    buffer += decoded_chunk
-                    
-                    # Process complete lines
-                    while "\n\n" in buffer:
-                        line, buffer = buffer.split("\n\n", 1)
-                        line = line.strip()
-                        
-                        if line and line.startswith("data: "):
-                            try:
-                                json_string = line[len("data: "):]
-                                json_data = json.loads(json_string)
-                                await queue.put(json_data)
-                            except json.JSONDecodeError as e:
-                                print(f"Could not decode JSON: {line} - Error: {e}")
-                                continue
-                except UnicodeDecodeError as e:
-                    print(f"Unicode decode error: {e}")
-                    await queue.put({"type": "error", "content": f"Unicode decode error: {e}"})
+                    await queue.put(orjson.loads(line[6:]))
+                except orjson.JSONDecodeError as e:
+                    print(f"Could not decode JSON: {line} - Error: {e}")
                     continue
-                    
+
     except httpx.TimeoutException:
         await queue.put({"type": "error", "content": "Request timed out. The agent might be taking too long to respond."})
     except httpx.RequestError as e:
@@ -50,8 +73,8 @@ async def _stream_from_backend(query: str, queue: asyncio.Queue):
     except Exception as e:
         await queue.put({"type": "error", "content": f"Unexpected error: {str(e)}"})
     finally:
-        await client.aclose()
-        # Don't add stream_end here, let the server handle it
+        # Sentinel: tells the consumer the backend stream is closed
+        await queue.put(None)
 
 async def stream_agent_response(query: str):
     """
@@ -75,101 +98,69 @@ async def stream_agent_response(query: str):
     queue = asyncio.Queue()
     stream_task = asyncio.create_task(_stream_from_backend(query.strip(), queue))
 
-    thoughts_log = []
-    context_log = []
+    # Running panel text, extended in place per event instead of re-joined per update
+    thoughts_display = ""
+    context_display = ""
     final_answer = ""
-    timeout_counter = 0
-    max_timeout = 300  # 5 minutes timeout
-    received_events = False
 
     try:
         while True:
-            try:
-                # Wait for event with timeout
-                event = await asyncio.wait_for(queue.get(), timeout=2.0)
-                timeout_counter = 0
-                received_events = True
-                
+            # No polling: the producer's httpx timeout bounds the wait and it
+            # always enqueues a None sentinel once the backend stream closes.
+            batch = [await queue.get()]
+            # Drain whatever else has already arrived so one UI update covers it
+            while len(batch) < _MAX_EVENT_BATCH:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            stream_ended = False
+            for event in batch:
+                if event is None:
+                    event = {"type": "stream_end"}
+
                 event_type = event.get("type")
                 content = event.get("content", "")
-                
-
-                if event_type == "thought":
-                    thoughts_log.append(f"💭 Thought: {content}")
-                    thoughts_display = "\n\n".join(thoughts_log)
-                    yield thoughts_display, final_answer, "\n\n".join(context_log)
-                    await asyncio.sleep(0.1)  # Small delay for UI update
-                    
-                elif event_type == "action":
-                    thoughts_log.append(f"⚡ Action: {content}")
-                    thoughts_display = "\n\n".join(thoughts_log)
-                    yield thoughts_display, final_answer, "\n\n".join(context_log)
-                    await asyncio.sleep(0.1)
-                    
-                elif event_type == "action_input":
-                    thoughts_log.append(f"📥 Action Input: {content}")
-                    thoughts_display = "\n\n".join(thoughts_log)
-                    yield thoughts_display, final_answer, "\n\n".join(context_log)
-                    await asyncio.sleep(0.1)
-                    
+
+                thought_label = _THOUGHT_LABELS.get(event_type)
+                if thought_label:
+                    line = f"{thought_label}: {content}"
+                    thoughts_display += "\n\n" + line if thoughts_display else line
+
                 elif event_type == "observation":
-                    display_content = content 
-                    context_log.append(f"🔍 Observation: {display_content}")
-                    thoughts_display = "\n\n".join(thoughts_log)
-                    context_display = "\n\n".join(context_log)
-                    yield thoughts_display, final_answer, context_display
-                    await asyncio.sleep(0.1)
-                    
+                    line = f"🔍 Observation: {content}"
+                    context_display += "\n\n" + line if context_display else line
+
                 elif event_type == "final_answer_end":
                     final_answer = content if content.strip() else "No response generated."
-                    thoughts_display = "\n\n".join(thoughts_log)
-                    context_display = "\n\n".join(context_log)
-                    yield thoughts_display, final_answer, context_display
-                    await asyncio.sleep(0.1)
-                    
+
                 elif event_type == "error":
                     error_msg = f"❌ Error: {content}"
-                    thoughts_log.append(error_msg)
+                    thoughts_display += "\n\n" + error_msg if thoughts_display else error_msg
                     if not final_answer:
                         final_answer = error_msg
-                    thoughts_display = "\n\n".join(thoughts_log)
-                    yield thoughts_display, final_answer, "\n\n".join(context_log)
-                    
+
                 elif event_type == "stream_end":
                     if not final_answer:
                         # Check if we got any events
-                        if thoughts_log or context_log:
+                        if thoughts_display or context_display:
                             final_answer = "Agent completed processing. Check the thoughts and observations above."
                         else:
                             final_answer = "Agent completed but no final answer was generated."
-                    thoughts_display = "\n\n".join(thoughts_log)
-                    context_display = "\n\n".join(context_log)
-                    yield thoughts_display, final_answer, context_display
+                    stream_ended = True
                     break
-                    
-            except asyncio.TimeoutError:
-                timeout_counter += 1
-                if timeout_counter >= max_timeout:
-                    final_answer = (final_answer or "") + "\n\n⏱️ Response timed out."
-                    yield "\n\n".join(thoughts_log), final_answer, "\n\n".join(context_log)
-                    break
-                # Continue waiting if we haven't received any events yet
-                if not received_events:
-                    continue
-                # If we've been waiting too long after receiving events, end the stream
-                if timeout_counter > 60:
-                    if not final_answer:
-                        final_answer = "Agent completed. Check the thoughts and observations."
-                    yield "\n\n".join(thoughts_log), final_answer, "\n\n".join(context_log)
-                    break
-                continue
-                
+
+            yield thoughts_display, final_answer, context_display
+            if stream_ended:
+                break
+
     except Exception as e:
         error_response = f"❌ UI Error: {str(e)}"
-        thoughts_log.append(error_response)
+        thoughts_display += "\n\n" + error_response if thoughts_display else error_response
         if not final_answer:
             final_answer = error_response
-        yield "\n\n".join(thoughts_log), final_answer, "\n\n".join(context_log)
+        yield thoughts_display, final_answer, context_display
     finally:
         if not stream_task.done():
             stream_task.cancel()
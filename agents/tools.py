@@ -1,10 +1,76 @@
 import os
+import io
+import mmap
+import stat
+import queue
+import re
+import shlex
+import shutil
+import select
+import signal
+import asyncio
 import subprocess
-from langchain.tools import tool
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from langchain.tools import tool, StructuredTool
 import pathspec
 
 from rag import retrieval, context_manager
 
+MAX_READ_BYTES = 256 * 1024
+BINARY_SNIFF_BYTES = 4096
+
+MAX_LIST_BYTES = 1024 * 1024
+
+SHELL_TIMEOUT_SECONDS = 30
+MAX_SHELL_OUTPUT_BYTES = 128 * 1024
+_TRUNCATED_NOTE = f"Output truncated at {MAX_SHELL_OUTPUT_BYTES} bytes and the command was killed"
+_TIMEOUT_NOTE = f"Command timed out after {SHELL_TIMEOUT_SECONDS}s and was killed"
+_SHELL_METACHARS = frozenset("|&;<>()$`*?[]{}~#\n")
+# Ask commands not to colorize; anything that still does gets stripped
+_NO_COLOR_ENV = {"NO_COLOR": "1", "ANSI_COLORS_DISABLED": "1", "TERM": "dumb"}
+_ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+# Reusable output buffers (two per command) and a bounded pool for async callers
+_BUF_POOL = queue.LifoQueue(maxsize=8)
+_SHELL_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="shell")
+
+
+@functools.lru_cache(maxsize=32)
+def _load_gitignore_spec(gitignore_path: str, mtime: float):
+    """Compile a .gitignore once per (path, mtime) so repeated calls reuse it."""
+    with open(gitignore_path, 'r') as f:
+        return pathspec.PathSpec.from_lines('gitwildmatch', f)
+
+
+def _walk(root: str, relative_root: str = ''):
+    """
+    Top-down os.scandir walk yielding (relative_root, subdirs, files) with
+    DirEntry lists, so d_type from readdir classifies entries without extra
+    stats. relative_root is '' or ends with a separator. Prune `subdirs` in
+    place to skip descending, like os.walk(topdown=True). Symlinked
+    directories are neither listed as files nor followed, and .git is skipped.
+    """
+    subdirs, files = [], []
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    files.append(entry)
+                elif entry.name != '.git':
+                    subdirs.append(entry)
+    except OSError:
+        return
+
+    yield relative_root, subdirs, files
+    for d in subdirs:
+        if not d.is_symlink():
+            yield from _walk(d.path, relative_root + d.name + os.sep)
 
 
 @tool
@@ -26,59 +92,44 @@ def list_files(directory: str = '.', use_gitignore: bool = True):
     if not os.path.isdir(directory):
         return f"Error: Directory {directory} not found."
 
-    all_files = []
-    
+    # Paths are written straight into one bytes buffer instead of a list of strs
+    buf = io.BytesIO()
+    truncated = False
+
     # Load .gitignore patterns
     spec = None
     if use_gitignore:
-        gitignore_path = os.path.join(directory, '.gitignore')
+        gitignore_path = os.path.abspath(os.path.join(directory, '.gitignore'))
         if os.path.exists(gitignore_path):
-            with open(gitignore_path, 'r') as f:
-                spec = pathspec.PathSpec.from_lines('gitwildmatch', f)
-
-    for root, dirs, files in os.walk(directory, topdown=True):
-        # Always ignore .git directory
-        if '.git' in dirs:
-            dirs.remove('.git')
-
-        # Paths should be relative to the directory where the gitignore is located for matching
-        relative_root = os.path.relpath(root, directory)
-        if relative_root == '.':
-            relative_root = ''
+            spec = _load_gitignore_spec(gitignore_path, os.path.getmtime(gitignore_path))
 
+    for relative_root, dirs, files in _walk(directory):
         if spec:
-            # Filter directories
-            paths_to_check = [os.path.join(relative_root, d) for d in dirs]
-            ignored_dirs = set(spec.match_files(paths_to_check))
-            
-            # Reconstruct ignored dir names from paths
-            ignored_dir_names = set()
-            for ignored_path in ignored_dirs:
-                # This is a simplification. It will not work correctly if the pattern has slashes.
-                ignored_dir_names.add(os.path.basename(ignored_path))
-
-            dirs[:] = [d for d in dirs if d not in ignored_dir_names]
-
-            # Filter files
-            paths_to_check = [os.path.join(relative_root, f) for f in files]
-            ignored_files = set(spec.match_files(paths_to_check))
-            
-            ignored_file_names = set()
-            for ignored_path in ignored_files:
-                ignored_file_names.add(os.path.basename(ignored_path))
-
-            for name in files:
-                if name not in ignored_file_names:
-                    all_files.append(os.path.join(root, name))
-        else:
-            for name in files:
-                all_files.append(os.path.join(root, name))
-
-
-    if not all_files:
+            # Match on the path relative to the .gitignore, with a trailing
+            # slash for directories so patterns like "build/" apply.
+            dirs[:] = [d for d in dirs if not spec.match_file(relative_root + d.name + "/")]
+
+        for entry in files:
+            if spec and spec.match_file(relative_root + entry.name):
+                continue
+            if buf.tell() >= MAX_LIST_BYTES:
+                truncated = True
+                break
+            buf.write(os.fsencode(entry.path))
+            buf.write(b"\n")
+        if truncated:
+            break
+
+    if not buf.tell():
         return f"The directory {directory} is empty."
 
-    return "\n".join(all_files)
+    # Drop the trailing newline
+    buf.truncate(buf.tell() - 1)
+    listing = buf.getvalue().decode('utf-8', errors='replace')
+    if truncated:
+        listing += (f"\n\n[Truncated: listing exceeded {MAX_LIST_BYTES} bytes. "
+                    "Narrow the directory or use `run_shell_command` with `find`.]")
+    return listing
 
 @tool
 def read_file(file_path: str):
@@ -94,19 +145,41 @@ def read_file(file_path: str):
     - After using `list_files` or `run_shell_command` (with `find`) to locate a file of interest.
 
     **IMPORTANT:** This tool is for reading one file at a time. Do not use it if another tool like `run_shell_command` (e.g., with `cat` or `grep`) could be more efficient for the user's goal.
+    Files larger than 256 KiB are truncated, and binary files are rejected.
     """
 
     try:
-        with open(file_path, "r", encoding='utf-8') as f:
-            return f.read()
+        st = os.stat(file_path)
+        is_regular = stat.S_ISREG(st.st_mode) and st.st_size > 0
+
+        with open(file_path, "rb") as f:
+            if is_regular:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if mm.find(b"\x00", 0, BINARY_SNIFF_BYTES) != -1:
+                        return f"Error: File '{file_path}' appears to be binary."
+                    data = mm[:MAX_READ_BYTES]
+                truncated = st.st_size > MAX_READ_BYTES
+            else:
+                # /proc, /sys and other non-regular files report no usable size
+                data = f.read(MAX_READ_BYTES + 1)
+                if b"\x00" in data[:BINARY_SNIFF_BYTES]:
+                    return f"Error: File '{file_path}' appears to be binary."
+                truncated = len(data) > MAX_READ_BYTES
+                data = data[:MAX_READ_BYTES]
+
+        content = data.decode('utf-8', errors='replace')
+        if truncated:
+            total = f" of {st.st_size}" if is_regular else ""
+            content += (f"\n\n[Truncated: showing the first {MAX_READ_BYTES}{total} bytes. "
+                        "Use `run_shell_command` (e.g. `sed -n` or `grep`) to inspect the rest.]")
+        return content
     except FileNotFoundError:
         return f"Error: File '{file_path}' not found."
     except Exception as e:
         return f"Error reading file '{file_path}': {e}"
 
 
-@tool
-def run_shell_command(command: str) -> str:
+def _run_shell_command(command: str) -> str:
     """
     Executes a shell command and returns its output. This is a powerful and versatile tool that should be your default choice for a wide range of tasks.
 
@@ -121,27 +194,146 @@ def run_shell_command(command: str) -> str:
     - If you are unsure which tool to use, consider if a shell command could solve the problem. This is often the most powerful tool available.
 
     **Input:** A valid shell command string.
-    **Output:** The stdout and stderr from the command.
+    **Output:** The stdout and stderr from the command. Output is capped at 128 KiB per stream and commands are killed after 30 seconds.
     """
     try:
-        result = subprocess.run(
-        command,
-        shell= True,
-        capture_output=True,
-        text=True,
-        check=True
-    )
-        output = f"\nSTDOUT:{result.stdout}\n"
-        if result.stderr:
-            output += f"\nSTDERR:{result.stderr}\n"
-        return output
-
-    except subprocess.CalledProcessError as e:
-        return f"""\nSTDERR:Error executing command: '{command}'\nExit Code:{e.returncode}
-                \nSTDOUT:\n {e.stdout}\nSTDERR\n{e.stderr}"""
+        proc = subprocess.Popen(
+            _command_argv(command),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env={**os.environ, **_NO_COLOR_ENV},
+            start_new_session=True,
+        )
+    except FileNotFoundError as e:
+        return f"\nSTDERR:Error executing command: '{command}'\n{e}"
     except Exception as e:
         return f"\nSTDERR:An unexpected error occurred : {e}"
 
+    try:
+        stdout, stderr, note = _collect_output(proc)
+    except Exception as e:
+        _kill_process_group(proc)
+        return f"\nSTDERR:An unexpected error occurred : {e}"
+
+    # Hitting the output cap is not a failure; the SIGKILL was ours, not the command's
+    killed_for_size = note == _TRUNCATED_NOTE and proc.returncode == -signal.SIGKILL
+    if proc.returncode != 0 and not killed_for_size:
+        output = f"""\nSTDERR:Error executing command: '{command}'\nExit Code:{proc.returncode}
+                \nSTDOUT:\n {stdout}\nSTDERR\n{stderr}"""
+    else:
+        output = f"\nSTDOUT:{stdout}\n"
+        if stderr:
+            output += f"\nSTDERR:{stderr}\n"
+    if note:
+        output += f"\n[{note}]\n"
+    return output
+
+
+async def _arun_shell_command(command: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_SHELL_EXECUTOR, _run_shell_command, command)
+
+
+run_shell_command = StructuredTool.from_function(
+    func=_run_shell_command,
+    coroutine=_arun_shell_command,
+    name="run_shell_command",
+)
+
+
+def _command_argv(command: str) -> list[str]:
+    """Split a command into argv, falling back to `/bin/sh -c` only when it needs a shell."""
+    if _SHELL_METACHARS.isdisjoint(command):
+        try:
+            args = shlex.split(command)
+        except ValueError:
+            args = None
+        # Leading VAR=value assignments are shell syntax too, and anything not
+        # on PATH may be a builtin (cd, command, type, ...), so both go to sh.
+        if args and '=' not in args[0] and shutil.which(args[0]):
+            return args
+    return ['/bin/sh', '-c', command]
+
+
+def _kill_process_group(proc: subprocess.Popen):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def _strip_ansi(text: str) -> str:
+    # Cheap containment check first; the regex only runs on colored output
+    return _ANSI_ESCAPE.sub('', text) if '\x1b' in text else text
+
+
+def _acquire_buffer() -> bytearray:
+    try:
+        return _BUF_POOL.get_nowait()
+    except queue.Empty:
+        # One spare byte lets a full buffer reveal that output was cut short
+        return bytearray(MAX_SHELL_OUTPUT_BYTES + 1)
+
+
+def _release_buffer(buf: bytearray):
+    try:
+        _BUF_POOL.put_nowait(buf)
+    except queue.Full:
+        pass
+
+
+def _collect_output(proc: subprocess.Popen) -> tuple[str, str, str | None]:
+    """
+    Drain stdout/stderr incrementally into pooled buffers, stopping at
+    MAX_SHELL_OUTPUT_BYTES per stream or after SHELL_TIMEOUT_SECONDS,
+    whichever comes first.
+    Returns the decoded output and a note describing why it was cut short, if it was.
+    """
+    out_fd, err_fd = proc.stdout.fileno(), proc.stderr.fileno()
+    bufs = {out_fd: _acquire_buffer(), err_fd: _acquire_buffer()}
+    views = {fd: memoryview(buf) for fd, buf in bufs.items()}
+    sizes = dict.fromkeys(bufs, 0)
+    open_fds = list(bufs)
+    deadline = time.monotonic() + SHELL_TIMEOUT_SECONDS
+    note = None
+
+    try:
+        while open_fds and note is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                note = _TIMEOUT_NOTE
+                break
+            ready, _, _ = select.select(open_fds, [], [], remaining)
+            for fd in ready:
+                n = os.readv(fd, [views[fd][sizes[fd]:]])
+                if not n:
+                    open_fds.remove(fd)
+                    continue
+                sizes[fd] += n
+                if sizes[fd] > MAX_SHELL_OUTPUT_BYTES:
+                    note = _TRUNCATED_NOTE
+
+        if note is None:
+            try:
+                proc.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                note = _TIMEOUT_NOTE
+        if note is not None:
+            _kill_process_group(proc)
+
+        stdout, stderr = (_strip_ansi(str(views[fd][:min(sizes[fd], MAX_SHELL_OUTPUT_BYTES)], 'utf-8', 'replace'))
+                          for fd in (out_fd, err_fd))
+    finally:
+        proc.stdout.close()
+        proc.stderr.close()
+        for fd, buf in bufs.items():
+            views[fd].release()
+            _release_buffer(buf)
+
+    return stdout, stderr, note
+
 
 @tool
 def codebase_search(query: str)-> str:
@@ -159,7 +351,14 @@ def codebase_search(query: str)-> str:
 
     print(f"Agent is using codebase_search tool with query :'{query}'")
 
-    retrieved_docs = retrieval.hybrid_search(query, k=10)
+    # Only whitespace is normalized: case matters for lexical matches on identifiers
+    return _search(" ".join(query.split()))
+
+
+@functools.lru_cache(maxsize=128)
+def _search(query_normalized: str) -> str:
+    """Retrieval + context assembly for a normalized query, cached across agent steps."""
+    retrieved_docs = retrieval.hybrid_search(query_normalized, k=10)
 
     context_str = context_manager.build_context(
         retrieved_docs,
@@ -171,3 +370,11 @@ def codebase_search(query: str)-> str:
         return "No relevant information found in codebase for the query."
 
     return f"\nCONTEXT:{context_str}\n"
+
+
+# Not called in this package: whatever re-indexes the codebase into the `rag`
+# retriever must call this once the rebuild finishes. Until then cached
+# results live for the whole process (bounded to 128 queries).
+def invalidate_search_cache():
+    """Drops cached codebase_search results; call after the index is rebuilt."""
+    _search.cache_clear()
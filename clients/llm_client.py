@@ -1,34 +1,59 @@
 import requests
-import json
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from rag import config
 
-def get_completion(prompt: str, 
-                   temperature: float = 0.8, 
-                   max_tokens: int =512)-> str | None:
+# Shared session so the connection to the LLM server is reused across calls
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=8,
+                                      pool_maxsize=32,
+                                      max_retries=Retry(total=2, backoff_factor=0.1)))
+
+def get_completion_stream(prompt: str,
+                          temperature: float = 0.8,
+                          max_tokens: int = 512):
     """
-    Generic function to get a completion from the LLM server.
+    Streams a completion from the LLM server, yielding content pieces as the
+    server generates them. Raises requests.exceptions.RequestException on failure.
     """
 
-    headers = {"Content-Type": "application/json"}
     data = {
         "prompt": prompt,
         "n_predict": max_tokens,
         "temperature": temperature,
-        "stop": ["\n"]
+        "stop": ["\n"],
+        "stream": True
     }
 
-    try:
-        completion_url = f"{config.LLAMA_SERVER_URL}/completion"
-        response = requests.post(completion_url,
-                                 headers=headers,
-                                 data=json.dumps(data))
+    completion_url = f"{config.LLAMA_SERVER_URL}/completion"
+    with _SESSION.post(completion_url,
+                       json=data,
+                       timeout=(3.05, 60),
+                       stream=True) as response:
         response.raise_for_status()
 
-        response_data = response.json()
-        content = response_data.get("content", "").strip()
-        return content
-    
-    except requests.exceptions.RequestException as e:
+        for line in response.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            chunk = orjson.loads(line[6:])
+            content = chunk.get("content")
+            if content:
+                yield content
+            if chunk.get("stop"):
+                break
+
+def get_completion(prompt: str,
+                   temperature: float = 0.8,
+                   max_tokens: int =512)-> str | None:
+    """
+    Generic function to get a completion from the LLM server.
+    """
+
+    try:
+        return "".join(get_completion_stream(prompt, temperature, max_tokens)).strip()
+
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         print(f"LLM request failed: {e}")
         return None
@@ -1,31 +1,36 @@
 from langchain_openai import ChatOpenAI
 import os
+import threading
 
 # Global variable to hold the LLM instance
 _llm = None
+_llm_lock = threading.Lock()
 
 def get_llm():
     """
     Returns a ChatOpenAI instance, initializing it only if it hasn't been already.
-    This is "lazy initialization".
+    This is "lazy initialization", guarded by a lock so concurrent first
+    callers don't construct it twice.
     """
     global _llm
     if _llm is None:
-        print("Initializing LLM client for the first time...")
-        base_url = os.getenv("LLAMA_SERVER_URL")
-        if not base_url:
-            raise ValueError("LLAMA_SERVER_URL environment variable not set.")
+        with _llm_lock:
+            if _llm is None:
+                print("Initializing LLM client for the first time...")
+                base_url = os.getenv("LLAMA_SERVER_URL")
+                if not base_url:
+                    raise ValueError("LLAMA_SERVER_URL environment variable not set.")
 
-        # Ensure the base_url has the /v1 suffix, as expected by the ChatOpenAI client
-        if not base_url.endswith("/v1"):
-            base_url = base_url.rstrip('/') + "/v1"
+                # Ensure the base_url has the /v1 suffix, as expected by the ChatOpenAI client
+                if not base_url.endswith("/v1"):
+                    base_url = base_url.rstrip('/') + "/v1"
 
-        _llm = ChatOpenAI(
-            base_url=base_url,
-            api_key="no_api_key",
-            temperature=0,
-            streaming=True,
-        )
+                _llm = ChatOpenAI(
+                    base_url=base_url,
+                    api_key="no_api_key",
+                    temperature=0,
+                    streaming=True,
+                )
     return _llm
 
 def get_completion(prompt: str) -> str: